@@ -14,8 +14,8 @@ fi
 # venv\Scripts\activate  # For Windows
 
 echo "Starting Celery workers..."
-celery -A src.repo_manager.celery_app worker --loglevel=info &  # Repo fetching worker
-celery -A src.assistant.celery_app worker --loglevel=info &  # AI analysis worker
+celery -A src.repo_manager.celery_app worker -Q fetch --prefetch-multiplier=4 --loglevel=info &  # Repo fetching worker
+celery -A src.assistant.celery_app worker -Q analyze --prefetch-multiplier=1 --concurrency=2 --loglevel=info &  # AI analysis worker
 
 echo "Starting FastAPI backend..."
 uvicorn src.endpoints:app --reload &  # Run FastAPI in background
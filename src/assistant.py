@@ -2,18 +2,34 @@
 assistant.py
 
 This module interacts with OpenAI's Assistant API to analyze repository code using Celery for background processing.
+Code embeddings are kept in a local FAISS index for in-process similarity search.
 """
 
 import asyncio
+import contextlib
+import hashlib
 import os
+import threading
+import uuid
+import weakref
+import httpx
 import openai
-import json
+from openai import AsyncOpenAI, OpenAI
+import orjson
+import faiss
+import tiktoken
+import numpy as np
 import redis
+from redis import asyncio as aioredis
 import time
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from filelock import FileLock
 from dotenv import load_dotenv
 from celery import Celery
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_exponential
 from opentelemetry import trace, metrics
+from src.celery_config import CELERY_BROKER_URL, CELERY_CONFIG
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -25,11 +41,71 @@ load_dotenv()
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 CACHE_EXPIRY = 86400  # 24 hours (in seconds)
 
-# Initialize Redis
-redis_client = redis.Redis(host='localhost', port=6379, db=0, decode_responses=True)
+# Initialize Redis (replies are parsed by hiredis when installed)
+# cache_client returns raw bytes for cached payloads; meta clients decode small human-readable values
+cache_client = redis.Redis(host='localhost', port=6379, db=0, decode_responses=False)
+meta_client = redis.Redis(host='localhost', port=6379, db=0, decode_responses=True)
+
+# redis.asyncio pools keep connections tied to the loop that opened them, so each event loop
+# (one per thread under --pool=threads) gets its own client; entries go away with their loop
+async_meta_clients = weakref.WeakKeyDictionary()
+
+def get_async_meta_client() -> aioredis.Redis:
+    """
+    Returns the asyncio Redis client for the running event loop, creating it on first use.
+
+    Returns:
+        redis.asyncio.Redis: Client decoding responses to str.
+    """
+    loop = asyncio.get_running_loop()
+    client = async_meta_clients.get(loop)
+    if client is None:
+        client = async_meta_clients[loop] = aioredis.Redis(host='localhost', port=6379, db=0, decode_responses=True)
+    return client
 
 # Initialize Celery
-celery_app = Celery("tasks", broker="redis://localhost:6379/0")
+celery_app = Celery("tasks", broker=CELERY_BROKER_URL)
+celery_app.conf.update(CELERY_CONFIG)
+
+# Shared OpenAI clients (created on first use so a missing API key doesn't fail imports)
+OPENAI_HTTP_LIMITS = httpx.Limits(max_connections=32, max_keepalive_connections=16)
+openai_client = None
+async_openai_clients = weakref.WeakKeyDictionary()  # Event loop -> AsyncOpenAI client
+
+def get_openai_client() -> OpenAI:
+    """
+    Returns the synchronous OpenAI client used by Celery tasks.
+
+    Returns:
+        OpenAI: Client backed by a pooled HTTP/2 connection.
+    """
+    global openai_client
+    if openai_client is None:
+        openai_client = OpenAI(
+            api_key=OPENAI_API_KEY,
+            http_client=httpx.Client(http2=True, limits=OPENAI_HTTP_LIMITS)
+        )
+    return openai_client
+
+def get_async_openai_client() -> AsyncOpenAI:
+    """
+    Returns the asynchronous OpenAI client for the running event loop.
+
+    httpx.AsyncClient connections can't be reused from another loop, so each loop (e.g.
+    successive asyncio.run calls, or one per thread) gets its own client.
+
+    Returns:
+        AsyncOpenAI: Client multiplexing concurrent requests over a pooled HTTP/2 connection.
+    """
+    loop = asyncio.get_running_loop()
+    client = async_openai_clients.get(loop)
+    if client is None:
+        client = async_openai_clients[loop] = AsyncOpenAI(
+            api_key=OPENAI_API_KEY,
+            http_client=httpx.AsyncClient(http2=True, limits=OPENAI_HTTP_LIMITS),
+            max_retries=0  # Retries are handled by create_embeddings
+        )
+    return client
 
 # Initialize OpenTelemetry Tracer & Metrics
 tracer = trace.get_tracer(__name__)
@@ -51,49 +127,363 @@ ai_request_failures = meter.create_counter(
     description="Counts AI request failures",
 )
 
-# OpenAI Vector Database API Configuration
-VECTOR_STORE_NAME = "repo_code_vectors"
+# Embedding & Local Vector Index Configuration
+EMBEDDING_MODEL = "text-embedding-ada-002"
+EMBEDDING_DIM = 1536  # Dimension of text-embedding-ada-002 vectors
+EMBEDDING_BATCH_SIZE = 96  # Max snippets sent per embeddings request
+EMBEDDING_MAX_INPUT_TOKENS = 8191  # Model limit per input; longer snippets are truncated
+EMBEDDING_MAX_BATCH_TOKENS = 200_000  # Stays under the API's total-tokens-per-request cap
+EMBEDDING_CONCURRENCY = 8  # Concurrent embeddings requests per repository
+EMBEDDING_MAX_ATTEMPTS = 5  # Attempts per batch on rate limits and transient errors
+EMBEDDING_MAX_RETRY_WAIT = 60  # Upper bound (seconds) on a single Retry-After pause
+EMBEDDING_IDS_KEY_PREFIX = "emb:ids:"  # Redis set (per index) of content hashes already stored
+ANALYSIS_CHANNEL_PREFIX = "analysis:"  # Redis pub/sub channel per task for streamed output
+
+# Repository Analysis Configuration
+ANALYSIS_MODEL = "gpt-4-turbo"
+ANALYSIS_SYSTEM_PROMPT = "You are an AI assistant specialized in analyzing code repositories."
+ANALYSIS_TOP_FILES = 20  # Files reviewed individually per repository
+ANALYSIS_CONCURRENCY = 5  # Concurrent per-file review requests
+MAX_FILE_PROMPT_CHARS = 12_000  # Per-file content cap (~3k tokens)
+NESTING_WEIGHT = 1000  # Characters of code one extra indentation level is worth when ranking
+DOC_EXTENSIONS = {".md"}  # Documentation is summarized by the repo-level pass, not reviewed per file
+HNSW_M = 32  # Graph neighbours per node in the HNSW index
+QUANTIZE_MIN_VECTORS = 1024  # Vectors gathered before training the int8 quantizer
+SEARCH_TOP_K = 5
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+VECTOR_INDEX_PATH = os.getenv("VECTOR_INDEX_PATH", os.path.join(PROJECT_ROOT, "repo.faiss"))
+VECTOR_METADATA_PATH = f"{VECTOR_INDEX_PATH}.meta.json"
+VECTOR_LOCK_PATH = f"{VECTOR_INDEX_PATH}.lock"  # Serializes index writers across processes
+VECTOR_LOCK_TIMEOUT = 30  # Seconds a writer waits for the index lock before giving up
+
+# In-process FAISS index; row i of the index is described by vector_metadata[i]
+vector_index = None
+vector_metadata = []
+vector_index_id = None  # Random id of the index, scopes its Redis id set
+vector_index_stamp = None  # (inode, mtime) of the index file that was loaded
+vector_index_guard = threading.Lock()  # Guards the globals above across threads of this process
+
+def embedding_ids_key() -> str:
+    """
+    Returns the Redis set recording which content hashes the current index holds.
+    """
+    return f"{EMBEDDING_IDS_KEY_PREFIX}{vector_index_id}"
 
-async def store_code_embeddings(repo_data: dict):
+def refresh_vector_index():
     """
-    Converts repository code snippets into vector embeddings and stores them in OpenAI's vector database.
+    Returns the FAISS index, reloading it from disk when another process has replaced it.
+
+    Callers must hold vector_index_guard. Reading needs no file lock: writers replace both
+    files atomically, metadata first, so metadata read after the index is never behind it.
+
+    Returns:
+        faiss.Index: HNSW index over unit-normalized code embeddings (int8 once trained).
+    """
+    global vector_index, vector_metadata, vector_index_id, vector_index_stamp
+
+    if os.path.exists(VECTOR_INDEX_PATH) and os.path.exists(VECTOR_METADATA_PATH):
+        stat = os.stat(VECTOR_INDEX_PATH)
+        stamp = (stat.st_ino, stat.st_mtime_ns)
+        if vector_index is None or stamp != vector_index_stamp:
+            index = faiss.read_index(VECTOR_INDEX_PATH)
+            with open(VECTOR_METADATA_PATH, "rb") as f:
+                metadata = orjson.loads(f.read())
+            # Metadata ahead of the index is expected mid-write; behind it means rows are missing
+            if metadata["ntotal"] < index.ntotal:
+                logger.warning(f"Vector metadata has {metadata['ntotal']} rows but the index has {index.ntotal}.")
+            vector_index = index
+            vector_metadata = metadata["rows"][:index.ntotal]
+            vector_index_id = metadata["index_id"]
+            vector_index_stamp = stamp
+    elif vector_index is None:
+        # Float storage until there are enough vectors to train the quantizer (see quantize_index)
+        vector_index = faiss.IndexHNSWFlat(EMBEDDING_DIM, HNSW_M)
+        vector_metadata = []
+        vector_index_id = uuid.uuid4().hex
+
+    return vector_index
+
+def load_vector_index() -> tuple:
+    """
+    Returns the FAISS index and its row metadata, reloading them when another process has
+    replaced the files. Blocks on disk I/O, so coroutines run it via asyncio.to_thread.
+
+    Returns:
+        tuple: (faiss.Index, list) where row i of the index is described by the list's item i.
+    """
+    with vector_index_guard:
+        return refresh_vector_index(), vector_metadata
+
+def search_vector_index(query_embedding: np.ndarray, k: int) -> tuple:
+    """
+    Searches the current FAISS index. FAISS doesn't support searching an index while
+    another thread adds to it, so this holds vector_index_guard; run it via asyncio.to_thread.
 
     Args:
-        repo_data (dict): Dictionary containing repository file paths and contents.
+        query_embedding (np.ndarray): Unit-normalized query vectors.
+        k (int): Neighbours to return per query.
+
+    Returns:
+        tuple: (distances, ids, rows) where rows is the metadata matching the searched index.
+    """
+    with vector_index_guard:
+        distances, ids = refresh_vector_index().search(query_embedding, k)
+        return distances, ids, vector_metadata
+
+def write_file_atomically(path: str, data: bytes):
+    """
+    Replaces a file in one step so readers never see a partially written version.
+
+    Args:
+        path (str): Destination file.
+        data (bytes): New contents.
+    """
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def quantize_index(index, vectors: np.ndarray):
+    """
+    Rebuilds a float index as an int8 one once enough vectors exist to train the quantizer.
+
+    The quantizer learns a value range per dimension from every stored vector plus the new
+    ones, so it is trained on a representative sample rather than the first batch.
+
+    Args:
+        index (faiss.Index): Float HNSW index.
+        vectors (np.ndarray): Unit-normalized vectors about to be added.
+
+    Returns:
+        faiss.Index: Trained HNSW index holding 1 byte per dimension, with rows in the same order.
+    """
+    stored = index.reconstruct_n(0, index.ntotal) if index.ntotal else np.empty((0, EMBEDDING_DIM), dtype="float32")
+    sample = np.vstack([stored, vectors])
+    quantized = faiss.IndexHNSWSQ(EMBEDDING_DIM, faiss.ScalarQuantizer.QT_8bit, HNSW_M)
+    quantized.train(sample)
+    quantized.add(sample)
+    return quantized
+
+def add_vectors(embeddings: list, metadata: list) -> str:
     """
+    Adds embeddings to the FAISS index and persists the index and its metadata to disk.
+
+    The read-add-write cycle runs under a file lock (waiting at most VECTOR_LOCK_TIMEOUT)
+    so concurrent writers don't overwrite each other's vectors. Blocks on disk I/O, so
+    coroutines run it via asyncio.to_thread.
+
+    Args:
+        embeddings (list): Embedding vectors to add.
+        metadata (list): One {"id", "file_path", "repo_url"} dict per embedding.
+
+    Returns:
+        str: Redis id set of the index the vectors were added to.
+    """
+    global vector_index, vector_metadata, vector_index_stamp
+
+    vectors = np.asarray(embeddings, dtype="float32")
+    faiss.normalize_L2(vectors)  # Unit length, so L2 ranking matches cosine similarity
+
+    with FileLock(VECTOR_LOCK_PATH, timeout=VECTOR_LOCK_TIMEOUT):
+        with vector_index_guard:
+            index = refresh_vector_index()  # Pick up vectors other processes added meanwhile
+            quantize = isinstance(index, faiss.IndexHNSWFlat) and index.ntotal + len(vectors) >= QUANTIZE_MIN_VECTORS
+            if not quantize:
+                index.add(vectors)
+                vector_metadata = vector_metadata + metadata  # New list, so readers keep a consistent snapshot
+
+        if quantize:
+            # The one-off rebuild takes seconds; searches keep using the float index until the swap.
+            # Only writers mutate the index and they are serialized by the file lock.
+            quantized = quantize_index(index, vectors)
+            with vector_index_guard:
+                index = vector_index = quantized
+                vector_metadata = vector_metadata + metadata
+
+        with vector_index_guard:
+            ids_key = embedding_ids_key()
+            metadata_blob = orjson.dumps({
+                "index_id": vector_index_id,
+                "ntotal": index.ntotal,
+                "rows": vector_metadata,
+            })
+            index_blob = faiss.serialize_index(index).tobytes()
+
+        # Metadata first: a reader pairing it with the previous index still finds every row it needs
+        write_file_atomically(VECTOR_METADATA_PATH, metadata_blob)
+        write_file_atomically(VECTOR_INDEX_PATH, index_blob)
+        stat = os.stat(VECTOR_INDEX_PATH)
+        with vector_index_guard:
+            vector_index_stamp = (stat.st_ino, stat.st_mtime_ns)
+
+        return ids_key
+
+# Tokenizer for the embedding model (loaded on first use)
+embedding_encoding = None
+
+def encode_for_embedding(text: str) -> list:
+    """
+    Tokenizes text for the embedding model, truncated to EMBEDDING_MAX_INPUT_TOKENS.
+
+    Args:
+        text (str): Text to embed.
+
+    Returns:
+        list: Token ids accepted as a single embeddings input.
+    """
+    global embedding_encoding
+    if embedding_encoding is None:
+        embedding_encoding = tiktoken.encoding_for_model(EMBEDDING_MODEL)
+    # Source files may legitimately contain special-token text such as <|endoftext|>
+    return embedding_encoding.encode(text, disallowed_special=())[:EMBEDDING_MAX_INPUT_TOKENS]
+
+def batch_for_embedding(items: list) -> list:
+    """
+    Groups snippets into embeddings requests bounded by item count and total tokens.
+
+    Args:
+        items (list): Tuples whose last element is the snippet's token ids.
+
+    Returns:
+        list: Batches of at most EMBEDDING_BATCH_SIZE items and EMBEDDING_MAX_BATCH_TOKENS tokens.
+    """
+    batches, batch, batch_tokens = [], [], 0
+    for item in items:
+        tokens = item[-1]
+        if batch and (len(batch) == EMBEDDING_BATCH_SIZE or batch_tokens + len(tokens) > EMBEDDING_MAX_BATCH_TOKENS):
+            batches.append(batch)
+            batch, batch_tokens = [], 0
+        batch.append(item)
+        batch_tokens += len(tokens)
+    if batch:
+        batches.append(batch)
+    return batches
+
+# Errors worth another attempt; the async client's own retries are disabled
+EMBEDDING_RETRY_ERRORS = (
+    openai.RateLimitError,
+    openai.APIConnectionError,
+    openai.APITimeoutError,
+    openai.InternalServerError,
+)
+
+def wait_for_retry_after(retry_state) -> float:
+    """
+    Tenacity wait strategy honoring the Retry-After header of a rate-limited (429) response.
+
+    Other errors, and 429s without a usable header, back off exponentially. No single wait
+    exceeds EMBEDDING_MAX_RETRY_WAIT.
+    """
+    error = retry_state.outcome.exception()
+    retry_after = error.response.headers.get("retry-after") if isinstance(error, openai.RateLimitError) else None
     try:
-        for file_path, code in repo_data.get("files", {}).items():
-            # Generate embedding for the code snippet
-            response = await openai.Embedding.acreate(
-                input=code,
-                model="text-embedding-ada-002"
-            )
-            embedding = response["data"][0]["embedding"]
+        return min(max(float(retry_after), 0), EMBEDDING_MAX_RETRY_WAIT)
+    except (TypeError, ValueError):
+        return wait_exponential(multiplier=1, max=EMBEDDING_MAX_RETRY_WAIT)(retry_state)
+
+@retry(
+    retry=retry_if_exception_type(EMBEDDING_RETRY_ERRORS),
+    wait=wait_for_retry_after,
+    stop=stop_after_attempt(EMBEDDING_MAX_ATTEMPTS),
+    reraise=True,
+)
+async def create_embeddings(inputs: list, semaphore: asyncio.Semaphore = None) -> list:
+    """
+    Embeds a batch of inputs, retrying rate limits, connection errors, timeouts and 5xx responses.
 
-            # Check if the embedding already exists
-            existing_vectors = await openai.VectorStore.asearch(
-                name=VECTOR_STORE_NAME,
-                query=embedding,
-                top_k=1  # Check for an exact match
-            )
+    Args:
+        inputs (list): Token id lists (from encode_for_embedding) to embed.
+        semaphore (asyncio.Semaphore, optional): Held for each attempt only, so waiting out
+            a rate limit doesn't block other batches.
 
-            if existing_vectors["matches"] and existing_vectors["matches"][0]["metadata"]["file_path"] == file_path:
+    Returns:
+        list: One embedding vector per input, in order.
+    """
+    async with semaphore or contextlib.nullcontext():
+        response = await get_async_openai_client().embeddings.create(
+            input=inputs,
+            model=EMBEDDING_MODEL
+        )
+    return [item.embedding for item in response.data]
+
+async def store_code_embeddings(repo_data: dict):
+    """
+    Converts repository code snippets into vector embeddings and stores them in the local FAISS index.
+
+    Each snippet is identified by the SHA-256 of its contents. Hashes already present in the
+    index's Redis id set are skipped. The rest are truncated to the model's input limit
+    and embedded in batches bounded by EMBEDDING_BATCH_SIZE and EMBEDDING_MAX_BATCH_TOKENS,
+    with up to EMBEDDING_CONCURRENCY requests in flight, then added to the index, persisted
+    and recorded once per repository. Batches that still fail after retries are logged and
+    left out; their files are not recorded, so a later run embeds them again.
+
+    Args:
+        repo_data (dict): Dictionary containing repository file paths and contents.
+    """
+    try:
+        files = [
+            (hashlib.sha256(code.encode()).hexdigest(), file_path, code)
+            for file_path, code in repo_data.get("files", {}).items()
+        ]
+
+        await asyncio.to_thread(load_vector_index)
+        ids_key = embedding_ids_key()
+
+        # Check which snippets are already stored in a single round-trip
+        async with get_async_meta_client().pipeline(transaction=False) as pipe:
+            for vid, _, _ in files:
+                pipe.sismember(ids_key, vid)
+            exists = await pipe.execute()
+
+        new_files = []
+        seen = set()
+        for (vid, file_path, code), stored in zip(files, exists):
+            if stored or vid in seen:
                 logger.info(f"Embedding for {file_path} already exists, skipping storage.")
                 continue  # Skip storing duplicate embeddings
+            seen.add(vid)
+            tokens = encode_for_embedding(code)
+            if tokens:  # The API rejects empty inputs
+                new_files.append((vid, file_path, tokens))
+
+        semaphore = asyncio.Semaphore(EMBEDDING_CONCURRENCY)
+
+        # Generate embeddings for all batches concurrently, one request per batch
+        batches = batch_for_embedding(new_files)
+        results = await asyncio.gather(
+            *(create_embeddings([tokens for _, _, tokens in batch], semaphore) for batch in batches),
+            return_exceptions=True
+        )
 
-            # Store or update the embedding in OpenAI's Vector Database
-            logger.info(f"Storing embedding for {file_path} in vector database.")
-            await openai.VectorStore.acreate(
-                name=VECTOR_STORE_NAME,
-                vectors=[{"id": file_path, "values": embedding, "metadata": {"repo_url": repo_data["repo_url"], "file_path": file_path}}]
-            )
+        embedded_files, embeddings = [], []
+        for batch, result in zip(batches, results):
+            if isinstance(result, BaseException):
+                logger.error(f"Failed to embed a batch of {len(batch)} files: {str(result)}")
+                continue
+            embedded_files.extend(batch)
+            embeddings.extend(result)
+
+        if not embeddings:
+            return
+
+        # Store the whole repository in the local vector index at once
+        logger.info(f"Storing {len(embeddings)} embeddings in vector index.")
+        ids_key = await asyncio.to_thread(add_vectors, embeddings, [
+            {"id": vid, "file_path": file_path, "repo_url": repo_data["repo_url"]}
+            for vid, file_path, _ in embedded_files
+        ])
+
+        # Record the stored ids so later runs against this index skip them
+        await get_async_meta_client().sadd(ids_key, *(vid for vid, _, _ in embedded_files))
     
     except Exception as e:
         logger.error(f"Error storing embeddings: {str(e)}")
 
 async def search_similar_code(query: str):
     """
-    Searches for code snippets similar to the given query in OpenAI's Vector Database.
+    Searches for code snippets similar to the given query in the local FAISS index.
 
     Args:
         query (str): User query describing the desired code.
@@ -104,41 +494,143 @@ async def search_similar_code(query: str):
     try:
         start_time = time.time()  # Track search execution time
 
-        response = await openai.Embedding.acreate(
-            input=query,
-            model="text-embedding-ada-002"
-        )
-        query_embedding = response["data"][0]["embedding"]
+        index, _ = await asyncio.to_thread(load_vector_index)
+        if index.ntotal == 0:
+            return []
 
-        # Perform vector search in OpenAI's database
-        search_results = await openai.VectorStore.asearch(
-            name=VECTOR_STORE_NAME,
-            query=query_embedding,
-            top_k=5  # Retrieve top 5 most relevant matches
-        )
+        query_embedding = np.asarray(await create_embeddings([encode_for_embedding(query)]), dtype="float32")
+        faiss.normalize_L2(query_embedding)
 
-        elapsed_time = time.time() - start_time
-        logger.info(f"Vector search executed in {elapsed_time:.3f} seconds, retrieved {len(search_results['matches'])} results.")
+        # Perform vector search in-process, off the event loop
+        distances, ids, rows = await asyncio.to_thread(search_vector_index, query_embedding, SEARCH_TOP_K)
 
         results = []
-        for match in search_results["matches"]:
+        for distance, idx in zip(distances[0], ids[0]):
+            if idx < 0 or idx >= len(rows):
+                continue  # Fewer than SEARCH_TOP_K vectors indexed
+            match = rows[idx]
             results.append({
-                "file_path": match["metadata"]["file_path"],
-                "repo_url": match["metadata"]["repo_url"],
-                "similarity_score": match["score"]
+                "file_path": match["file_path"],
+                "repo_url": match["repo_url"],
+                "similarity_score": float(1 - distance / 2)  # Squared L2 -> cosine on unit vectors
             })
 
+        elapsed_time = time.time() - start_time
+        logger.info(f"Vector search executed in {elapsed_time:.3f} seconds, retrieved {len(results)} results.")
+
         return results
 
     except Exception as e:
         logger.error(f"Error searching code embeddings: {str(e)}")
         return []
 
+def build_analysis_cache_key(repo_data: dict) -> str:
+    """
+    Builds a process-independent cache key for a repository analysis.
+
+    File paths and contents are fed incrementally into a BLAKE2b digest in sorted order,
+    so the key is stable across workers without serializing the whole repository.
+
+    Args:
+        repo_data (dict): The repository contents (files and their code).
+
+    Returns:
+        str: Redis key for the cached analysis.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    files = repo_data.get("files", {})
+    for file_path in sorted(files):
+        digest.update(file_path.encode())
+        digest.update(b"\0")
+        digest.update(files[file_path].encode())
+        digest.update(b"\0")
+    return f"ai_analysis:{digest.hexdigest()}"
+
+def publish_analysis_event(task_id: str, event_type: str, **fields):
+    """
+    Publishes a message on the task's ``analysis:<task_id>`` channel.
+
+    Messages are JSON objects: ``{"type": "delta", "content": ...}`` for each piece of output,
+    then exactly one terminal ``{"type": "done"}`` or ``{"type": "error", "error": ...}``.
+
+    Args:
+        task_id (str): Celery task ID the stream belongs to.
+        event_type (str): "delta", "done" or "error".
+        **fields: Event payload.
+    """
+    meta_client.publish(f"{ANALYSIS_CHANNEL_PREFIX}{task_id}", orjson.dumps({"type": event_type, **fields}))
+
+def complexity_score(code: str) -> int:
+    """
+    Estimates how much review a file needs from its size plus its deepest indentation level.
+
+    Args:
+        code (str): File contents.
+
+    Returns:
+        int: Score where larger means more complex.
+    """
+    max_depth = 0
+    for line in code.splitlines():
+        stripped = line.lstrip()
+        if stripped:
+            indent = len(line.expandtabs(4)) - len(stripped)
+            max_depth = max(max_depth, indent // 4)
+    return len(code) + NESTING_WEIGHT * max_depth
+
+def select_files_for_analysis(files: dict, limit: int = ANALYSIS_TOP_FILES) -> list:
+    """
+    Picks the source files most worth reviewing so the prompt size stays bounded.
+
+    Args:
+        files (dict): Mapping of file paths to contents.
+        limit (int): Maximum number of files to return.
+
+    Returns:
+        list: (file_path, code) pairs, most complex first. Documentation files are never selected.
+    """
+    source_files = [
+        (file_path, code) for file_path, code in files.items()
+        if os.path.splitext(file_path)[1].lower() not in DOC_EXTENSIONS
+    ]
+    ranked = sorted(source_files, key=lambda item: complexity_score(item[1]), reverse=True)
+    return ranked[:limit]
+
+def analyze_file(file_path: str, code: str) -> str:
+    """
+    Requests a short review of a single file (the map step of the repository analysis).
+
+    Args:
+        file_path (str): Path of the file within the repository.
+        code (str): File contents, truncated to MAX_FILE_PROMPT_CHARS.
+
+    Returns:
+        str: Concise findings for the file.
+    """
+    prompt = (
+        f"Review the file `{file_path}` and list concise findings on code complexity, "
+        "security issues, best practices and documentation gaps.\n"
+        f"{code[:MAX_FILE_PROMPT_CHARS]}"
+    )
+    response = get_openai_client().chat.completions.create(
+        model=ANALYSIS_MODEL,
+        messages=[
+            {"role": "system", "content": ANALYSIS_SYSTEM_PROMPT},
+            {"role": "user", "content": prompt}
+        ]
+    )
+    return response.choices[0].message.content
+
 @celery_app.task(bind=True)
 def analyze_code_task(self, repo_data: dict) -> str:
     """
     Celery task to process AI-based repository analysis in the background.
 
+    The most complex files are reviewed individually in parallel, then the per-file
+    findings are summarized into the final report. That response is streamed: each text
+    delta is published on the ``analysis:<task_id>`` Redis channel as it is generated,
+    followed by a terminal "done" or "error" message (see publish_analysis_event).
+
     Args:
         repo_data (dict): The repository contents (files and their code).
 
@@ -150,13 +642,20 @@ def analyze_code_task(self, repo_data: dict) -> str:
 
     if not OPENAI_API_KEY:
         logger.error(f"Task {task_id} failed: OpenAI API key is missing.")
+        publish_analysis_event(task_id, "error", error="OpenAI API key is missing.")
         return "Error: OpenAI API key is missing."
 
-    cache_key = f"ai_analysis:{hash(json.dumps(repo_data, sort_keys=True))}"
-    cached_result = redis_client.get(cache_key)
+    cache_key = build_analysis_cache_key(repo_data)
+    pipe = cache_client.pipeline(transaction=False)
+    pipe.get(cache_key)
+    pipe.ttl(cache_key)
+    cached_result, cache_ttl = pipe.execute()
 
     if cached_result:
-        logger.info(f"Task {task_id}: Returning cached AI response.")
+        logger.info(f"Task {task_id}: Returning cached AI response (expires in {cache_ttl}s).")
+        cached_result = cached_result.decode()
+        publish_analysis_event(task_id, "delta", content=cached_result)
+        publish_analysis_event(task_id, "done")
         return cached_result  # Return cached AI response
 
     with tracer.start_as_current_span("analyze_code"):
@@ -164,45 +663,75 @@ def analyze_code_task(self, repo_data: dict) -> str:
         start_time = time.time()
 
         try:
+            files = repo_data.get("files", {})
+            selected_files = select_files_for_analysis(files)
+
+            # Map: review the selected files in parallel
+            with ThreadPoolExecutor(max_workers=ANALYSIS_CONCURRENCY) as executor:
+                file_reviews = list(executor.map(lambda item: analyze_file(*item), selected_files))
+            file_findings = {file_path: review for (file_path, _), review in zip(selected_files, file_reviews)}
+
+            # Reduce: summarize the per-file findings into one report
             prompt = (
                 "You are an advanced AI that specializes in analyzing GitHub repositories. "
-                "Analyze the provided repository contents and provide structured insights, including:\n"
+                "Combine the per-file findings below into structured insights for the repository, including:\n"
                 "- **Code Complexity**: Identify overly complex functions or areas needing refactoring.\n"
                 "- **Security Issues**: Highlight potential vulnerabilities.\n"
                 "- **Best Practices**: Suggest improvements based on coding standards.\n"
                 "- **Documentation Gaps**: Identify missing or inadequate documentation.\n"
-                "Repository contents:\n"
-                f"{json.dumps(repo_data, indent=2)}"
+                f"The repository has {len(files)} files; the {len(selected_files)} most complex were reviewed.\n"
+                "Per-file findings:\n"
+                f"{orjson.dumps(file_findings).decode()}"
             )
 
-            response = openai.ChatCompletion.create(
-                model="gpt-4-turbo",
+            stream = get_openai_client().chat.completions.create(
+                model=ANALYSIS_MODEL,
                 messages=[
-                    {"role": "system", "content": "You are an AI assistant specialized in analyzing code repositories."},
+                    {"role": "system", "content": ANALYSIS_SYSTEM_PROMPT},
                     {"role": "user", "content": prompt}
                 ],
-                api_key=OPENAI_API_KEY
+                stream=True
             )
 
-            analysis_result = response["choices"][0]["message"]["content"]
+            # Publish partial output as it arrives so subscribers can relay it before the task finishes
+            chunks = []
+            first_token_time = None
+            for chunk in stream:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content or ""
+                if not delta:
+                    continue
+                if first_token_time is None:
+                    first_token_time = time.time() - start_time
+                chunks.append(delta)
+                publish_analysis_event(task_id, "delta", content=delta)
+
+            analysis_result = "".join(chunks)
 
             # Log response quality
             span = trace.get_current_span()
             span.add_event("AI Response Generated", {
                 "task_id": task_id,
+                "first_token_seconds": first_token_time or 0.0,
                 "response_length": len(analysis_result),
                 "is_truncated": "..." in analysis_result
             })
 
-            # Cache the result for future queries
-            redis_client.setex(cache_key, CACHE_EXPIRY, analysis_result)
+            # Cache the result for future queries and record the analyzed repo
+            pipe = cache_client.pipeline(transaction=False)
+            pipe.setex(cache_key, CACHE_EXPIRY, analysis_result)
+            if repo_data.get("repo_url"):
+                pipe.sadd("analyzed_repos", repo_data["repo_url"])
+            pipe.execute()
 
             ai_request_duration.record(time.time() - start_time)  # Log response time
             logger.info(f"Task {task_id} completed successfully.")
+            publish_analysis_event(task_id, "done")
 
             return analysis_result
 
-        except openai.error.OpenAIError as e:
+        except openai.OpenAIError as e:
             ai_request_failures.add(1)  # Increment failure count
             ai_request_duration.record(time.time() - start_time)  # Log failed request time
             span = trace.get_current_span()
@@ -211,5 +740,10 @@ def analyze_code_task(self, repo_data: dict) -> str:
                 "error": str(e)
             })
             logger.error(f"Task {task_id} failed: {str(e)}")
+            publish_analysis_event(task_id, "error", error=str(e))
             return f"Error: {str(e)}"
 
+        except Exception as e:
+            publish_analysis_event(task_id, "error", error=str(e))  # Don't leave subscribers waiting
+            raise
+
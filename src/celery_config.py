@@ -0,0 +1,32 @@
+"""
+celery_config.py
+
+This module holds the Celery settings shared by the repo fetching and AI analysis workers.
+"""
+
+CELERY_BROKER_URL = "redis://localhost:6379/0"
+CELERY_RESULT_BACKEND = "redis://localhost:6379/1"  # Kept apart from the broker queues
+FETCH_PRIORITY = 0  # Redis transport: 0 is consumed first, 9 last
+
+CELERY_CONFIG = {
+    # msgpack is faster and smaller than JSON for the large repo_data payloads
+    "task_serializer": "msgpack",
+    "result_serializer": "msgpack",
+    "accept_content": ["msgpack"],
+    "result_backend": CELERY_RESULT_BACKEND,
+    "result_compression": "zstd",
+    "broker_transport_options": {
+        "visibility_timeout": 3600,
+        "queue_order_strategy": "priority",
+        "priority_steps": list(range(10)),
+    },
+    # Cheap fetches and long AI analyses run on separate queues so neither blocks the other
+    "task_routes": {
+        "src.repo_manager.*": {"queue": "fetch"},
+        "src.assistant.*": {"queue": "analyze"},
+    },
+    "task_queue_max_priority": 9,
+    "task_default_priority": 5,
+    # Don't let a worker reserve extra tasks behind a long-running one
+    "worker_prefetch_multiplier": 1,
+}
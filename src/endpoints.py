@@ -8,13 +8,14 @@ for repository analysis.
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
 import asyncio
+import time
 from celery.result import AsyncResult  # Import Celery result tracking
 from src.repo_manager import fetch_repo_contents_task, celery_app  # Ensure Celery task is imported
 from src.assistant import analyze_code_task  # Import Celery task
+from src.celery_config import FETCH_PRIORITY
 from src.logging_setup import get_tracer
 from dotenv import load_dotenv
 import os
-import time  # Import time for logging execution time
 import logging
 
 # Load environment variables from .env file
@@ -39,7 +40,7 @@ async def fetch_repository(request: RepoRequest):
     2. Return the task ID for tracking
     """
     with tracer.start_as_current_span("fetch_repository"):
-        task = fetch_repo_contents_task.delay(request.repo_url)  # Enqueue Celery task
+        task = fetch_repo_contents_task.apply_async(args=[request.repo_url], priority=FETCH_PRIORITY)  # Enqueue Celery task
         return {"task_id": task.id, "message": "Fetching repository in background"}
 
 @app.post("/analyze")
@@ -48,7 +49,7 @@ async def analyze_repo(request: RepoRequest):
     API endpoint to analyze a GitHub repository.
     
     Steps:
-    1. Check the status of the repo fetch task
+    1. Enqueue a repo fetch task and poll its status
     2. If still in progress, return a message to the user
     3. If fetch is successful, proceed with AI analysis
     4. If fetch fails, retry up to 3 times before returning an error
@@ -57,30 +58,32 @@ async def analyze_repo(request: RepoRequest):
         retry_attempts = 3
         backoff_time = 2  # Start with a 2-second delay
 
+        # Enqueue the fetch once and poll it; only re-enqueue after a failure
+        fetch_task = fetch_repo_contents_task.apply_async(args=[request.repo_url], priority=FETCH_PRIORITY)
+        enqueued_at = time.monotonic()
+
         for attempt in range(retry_attempts):
-            # Retrieve the most recent fetch task from Celery
-            fetch_task_id = fetch_repo_contents_task.delay(request.repo_url).id
-            fetch_task = AsyncResult(fetch_task_id, app=celery_app)
             if fetch_task.ready():
                 if fetch_task.failed():
                     if attempt < retry_attempts - 1:
-                        time.sleep(backoff_time)  # Exponential backoff
+                        await asyncio.sleep(backoff_time)  # Exponential backoff
                         backoff_time *= 2
-                        continue  # Retry fetching
+                        fetch_task = fetch_repo_contents_task.apply_async(args=[request.repo_url], priority=FETCH_PRIORITY)  # Retry fetching
+                        enqueued_at = time.monotonic()
+                        continue
                     return {"error": "Repository fetching failed after multiple attempts. Unable to proceed with analysis."}
 
                 repo_data = fetch_task.result  # Get fetched repo data
 
-                # Log time elapsed between fetching and analysis
-                fetch_time = fetch_task.date_done.timestamp() - fetch_task.date_created.timestamp()
-                tracer.get_tracer(__name__).start_as_current_span("fetch_to_analysis_time").add_event(
-                    f"Time elapsed between fetching and analysis: {fetch_time:.2f} seconds"
-                )
+                # Log time elapsed between enqueuing the fetch and starting analysis
+                fetch_time = time.monotonic() - enqueued_at
+                with tracer.start_as_current_span("fetch_to_analysis_time") as span:
+                    span.add_event(f"Time elapsed between fetching and analysis: {fetch_time:.2f} seconds")
 
                 task = analyze_code_task.delay(repo_data)  # Enqueue Celery task for AI analysis
                 return {"task_id": task.id, "message": "AI analysis started"}
 
-            time.sleep(backoff_time)  # Wait before retrying
+            await asyncio.sleep(backoff_time)  # Wait before retrying
             backoff_time *= 2  # Exponential backoff
 
         return {"message": "Repository fetching is still in progress. Please check task status."}
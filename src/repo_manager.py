@@ -8,12 +8,18 @@ import os
 import asyncio
 import aiohttp
 import redis
-import json
+from redis import asyncio as aioredis
 import time
 import logging
+import weakref
+import msgpack
+from urllib.parse import quote
+import zstandard
 from dotenv import load_dotenv
 from opentelemetry import trace
 from celery import Celery
+from celery.signals import worker_process_init, worker_process_shutdown
+from src.celery_config import CELERY_BROKER_URL, CELERY_RESULT_BACKEND, CELERY_CONFIG
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -24,25 +30,117 @@ load_dotenv()
 
 GITHUB_API_TOKEN = os.getenv("GITHUB_API_TOKEN")
 CACHE_EXPIRY = 86400  # 24 hours (in seconds)
+REPO_CACHE_KEY_PREFIX = "repo_cache:v2:"  # Bumped when the cached payload format changes
+FETCH_CONCURRENCY = 24  # Max concurrent file downloads per repository
+RATE_LIMIT_THRESHOLD = 10  # Pause when fewer GitHub requests than this remain
+RATE_LIMIT_MAX_WAIT = 60  # Upper bound (seconds) on a single rate-limit pause
 
-# Initialize Redis
-redis_client = redis.Redis(host='localhost', port=6379, db=0, decode_responses=True)
+# Only source and documentation files are worth downloading for analysis
+ALLOWED_EXTENSIONS = {".py", ".js", ".ts", ".go", ".rs", ".java", ".c", ".h", ".cpp", ".md"}
+MAX_FILE_SIZE = 256_000  # bytes
+
+# Initialize Redis (replies are parsed by hiredis when installed)
+# Cached repo payloads are compressed bytes, so responses are left undecoded
+cache_client = redis.Redis(host='localhost', port=6379, db=0, decode_responses=False)
+
+# redis.asyncio pools keep connections tied to the loop that opened them, so each event loop
+# (one per thread under --pool=threads) gets its own client; entries go away with their loop
+async_cache_clients = weakref.WeakKeyDictionary()
+
+# Repo caches are stored as zstd-compressed msgpack
+CACHE_COMPRESSION_LEVEL = 3
 
 # Initialize Celery with Redis as the result backend
 from celery import Celery
 
 celery_app = Celery(
     "tasks",
-    broker="redis://localhost:6379/0",
-    backend="redis://localhost:6379/0",
+    broker=CELERY_BROKER_URL,
+    backend=CELERY_RESULT_BACKEND,
     include=["src.repo_manager"]  # Ensure Celery discovers tasks in this module
 )
+celery_app.conf.update(CELERY_CONFIG)
 
 celery_app.autodiscover_tasks(["src"])
 
 # Initialize OpenTelemetry Tracer
 tracer = trace.get_tracer(__name__)
 
+def get_async_cache_client() -> aioredis.Redis:
+    """
+    Returns the asyncio Redis client for the running event loop, creating it on first use.
+
+    Returns:
+        redis.asyncio.Redis: Client returning raw bytes.
+    """
+    loop = asyncio.get_running_loop()
+    client = async_cache_clients.get(loop)
+    if client is None:
+        client = async_cache_clients[loop] = aioredis.Redis(host='localhost', port=6379, db=0, decode_responses=False)
+    return client
+
+async def close_async_cache_client():
+    """
+    Closes the running loop's asyncio Redis client before the loop goes away.
+    """
+    client = async_cache_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+async def fetch_repo_contents_once(repo_url: str) -> dict:
+    """
+    Fetches a repository on a short-lived event loop, releasing that loop's Redis connections.
+
+    Args:
+        repo_url (str): The GitHub repository URL.
+
+    Returns:
+        dict: Dictionary containing repo file paths and their contents.
+    """
+    try:
+        return await fetch_repo_contents(repo_url)
+    finally:
+        await close_async_cache_client()
+
+# Long-lived event loop and HTTP session per worker process (set up by init_worker_http)
+worker_loop = None
+worker_session = None
+
+async def create_http_session() -> aiohttp.ClientSession:
+    """
+    Creates an aiohttp session with a pooled, keep-alive connector for GitHub requests.
+
+    Returns:
+        aiohttp.ClientSession: Session to be reused across fetches.
+    """
+    connector = aiohttp.TCPConnector(limit=64, ttl_dns_cache=300, keepalive_timeout=60)
+    return aiohttp.ClientSession(connector=connector)
+
+@worker_process_init.connect
+def init_worker_http(**kwargs):
+    """
+    Builds the event loop and HTTP session reused by every task in this worker process.
+    """
+    global worker_loop, worker_session
+    worker_loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(worker_loop)
+    worker_session = worker_loop.run_until_complete(create_http_session())
+    logger.info("Initialized worker event loop and HTTP session.")
+
+@worker_process_shutdown.connect
+def shutdown_worker_http(**kwargs):
+    """
+    Closes the worker's HTTP session, Redis connections and event loop.
+    """
+    global worker_loop, worker_session
+    if worker_loop is None:
+        return
+    if worker_session is not None:
+        worker_loop.run_until_complete(worker_session.close())
+    worker_loop.run_until_complete(close_async_cache_client())
+    worker_loop.close()
+    worker_loop, worker_session = None, None
+
 @celery_app.task(bind=True)
 def fetch_repo_contents_task(self, repo_url: str) -> dict:
     """
@@ -57,7 +155,10 @@ def fetch_repo_contents_task(self, repo_url: str) -> dict:
     logger.info(f"Starting repository fetch task: {self.request.id} for {repo_url}")
 
     try:
-        result = asyncio.run(fetch_repo_contents(repo_url))
+        if worker_loop is not None:
+            result = worker_loop.run_until_complete(fetch_repo_contents(repo_url, session=worker_session))
+        else:
+            result = asyncio.run(fetch_repo_contents_once(repo_url))  # e.g. solo/threads pools, eager mode
         self.update_state(state="SUCCESS", meta=result)  # Store task results
         logger.info(f"Task {self.request.id} completed successfully.")
         return result
@@ -66,23 +167,34 @@ def fetch_repo_contents_task(self, repo_url: str) -> dict:
         self.update_state(state="FAILURE", meta={"error": str(e)})
         return {"error": str(e)}
 
-async def fetch_repo_contents(repo_url: str) -> dict:
+async def fetch_repo_contents(repo_url: str, session: aiohttp.ClientSession = None) -> dict:
     """
     Fetch repository contents from GitHub asynchronously, with caching.
 
     Args:
         repo_url (str): The GitHub repository URL.
+        session (aiohttp.ClientSession, optional): Session to reuse. A temporary one is
+            created and closed when omitted.
 
     Returns:
         dict: Dictionary containing repo file paths and their contents.
     """
     with tracer.start_as_current_span("fetch_repo_contents") as span:
-        cache_key = f"repo_cache:{repo_url}"
-        cached_data = redis_client.get(cache_key)
+        cache_key = repo_cache_key(repo_url)
+        async with get_async_cache_client().pipeline(transaction=False) as pipe:
+            pipe.get(cache_key)
+            pipe.ttl(cache_key)
+            cached_data, cache_ttl = await pipe.execute()
 
         if cached_data:
-            span.add_event("Cache hit")
-            return json.loads(cached_data)  # Return cached repo data
+            try:
+                repo_cache = unpack_repo_cache(cached_data)
+            except (zstandard.ZstdError, ValueError) as e:
+                # An unreadable entry is refetched and overwritten rather than failing the fetch
+                logger.warning(f"Discarding unreadable cache entry for {repo_url}: {str(e)}")
+            else:
+                span.add_event(f"Cache hit, expires in {cache_ttl} seconds")
+                return repo_cache  # Return cached repo data
 
         span.add_event("Cache miss, fetching from GitHub")
 
@@ -90,80 +202,169 @@ async def fetch_repo_contents(repo_url: str) -> dict:
         if not repo_owner or not repo_name:
             return {"error": "Invalid GitHub repository URL format."}
 
-        api_url = f"https://api.github.com/repos/{repo_owner}/{repo_name}/contents"
+        api_url = f"https://api.github.com/repos/{repo_owner}/{repo_name}"
         headers = {"Authorization": f"token {GITHUB_API_TOKEN}"} if GITHUB_API_TOKEN else {}
 
-        async with aiohttp.ClientSession() as session:
-            try:
-                start_time = time.time()
-                async with session.get(api_url, headers=headers) as response:
-                    duration = time.time() - start_time
-                    span.add_event(f"GitHub API request took {duration:.2f} seconds")
-
-                    if response.status == 200:
-                        file_data = await response.json()
-                        repo_files = await process_repo_files(file_data, session)
-
-                        # Store in Redis cache with timestamp
-                        repo_cache = {
-                            "repo_url": repo_url,
-                            "files": repo_files,
-                            "timestamp": time.time(),
-                        }
-                        redis_client.setex(cache_key, CACHE_EXPIRY, json.dumps(repo_cache))
-
-                        return repo_cache
-                    elif response.status == 403:
-                        span.add_event("GitHub API rate limit exceeded")
-                        return {"error": "GitHub API rate limit exceeded. Try again later."}
-                    elif response.status == 404:
-                        return {"error": "Repository not found. Check if the URL is correct."}
-                    else:
-                        return {"error": f"Unexpected error from GitHub API: {response.status}"}
-            except Exception as e:
-                span.add_event(f"Exception occurred: {str(e)}")
-                return {"error": "An error occurred while fetching the repository."}
-
-async def process_repo_files(file_data, session):
+        owns_session = session is None
+        if owns_session:
+            session = aiohttp.ClientSession()
+
+        try:
+            start_time = time.time()
+
+            # Resolve the default branch, then list the whole tree in a single call
+            async with session.get(api_url, headers=headers) as response:
+                await wait_for_rate_limit(response)
+                if response.status != 200:
+                    return github_error(response.status, span)
+                default_branch = (await response.json())["default_branch"]
+
+            tree_url = f"{api_url}/git/trees/{quote(default_branch, safe='')}?recursive=1"
+            async with session.get(tree_url, headers=headers) as response:
+                duration = time.time() - start_time
+                span.add_event(f"GitHub API request took {duration:.2f} seconds")
+                await wait_for_rate_limit(response)
+                if response.status != 200:
+                    return github_error(response.status, span)
+                tree_data = await response.json()
+
+            if tree_data.get("truncated"):
+                logger.warning(f"GitHub truncated the file tree for {repo_url}; some files will be missing.")
+
+            raw_base_url = f"https://raw.githubusercontent.com/{repo_owner}/{repo_name}/{quote(default_branch)}"
+            file_data = [
+                {
+                    "path": entry["path"],
+                    "type": "file",
+                    "size": entry.get("size", 0),
+                    "download_url": f"{raw_base_url}/{quote(entry['path'])}",
+                }
+                for entry in tree_data.get("tree", [])
+                if entry["type"] == "blob"
+            ]
+            repo_files = await process_repo_files(file_data, session, headers)
+
+            # Store in Redis cache with timestamp
+            repo_cache = {
+                "repo_url": repo_url,
+                "files": repo_files,
+                "timestamp": time.time(),
+            }
+            async with get_async_cache_client().pipeline(transaction=False) as pipe:
+                pipe.setex(cache_key, CACHE_EXPIRY, pack_repo_cache(repo_cache))
+                pipe.sadd("fetched_repos", repo_url)
+                await pipe.execute()
+
+            return repo_cache
+        except Exception as e:
+            span.add_event(f"Exception occurred: {str(e)}")
+            return {"error": "An error occurred while fetching the repository."}
+        finally:
+            if owns_session:
+                await session.close()
+
+def github_error(status: int, span) -> dict:
+    """
+    Maps a failed GitHub API response status to an error result.
+
+    Args:
+        status (int): HTTP status returned by GitHub.
+        span: Current OpenTelemetry span.
+
+    Returns:
+        dict: Error payload returned to the caller.
+    """
+    if status == 403:
+        span.add_event("GitHub API rate limit exceeded")
+        return {"error": "GitHub API rate limit exceeded. Try again later."}
+    if status == 404:
+        return {"error": "Repository not found. Check if the URL is correct."}
+    return {"error": f"Unexpected error from GitHub API: {status}"}
+
+async def process_repo_files(file_data, session, headers: dict = None):
     """
     Process repository file structure and fetch file contents.
 
     Args:
-        file_data (list): List of files from the GitHub API.
+        file_data (list): File entries ({"path", "type", "size", "download_url"}) from the repository tree.
         session (aiohttp.ClientSession): Async session for HTTP requests.
+        headers (dict, optional): Request headers, e.g. the GitHub token needed for private repos.
 
     Returns:
-        dict: Dictionary of file paths and their contents.
+        dict: Dictionary of file paths and their contents. Files that fail to download are left out.
     """
     repo_files = {}
-    tasks = []
+    semaphore = asyncio.Semaphore(FETCH_CONCURRENCY)
 
-    for file in file_data:
-        if file["type"] == "file":  # Skip directories
-            tasks.append(fetch_file_content(file["download_url"], session))
+    async def fetch_bounded(file):
+        async with semaphore:
+            return file["path"], await fetch_file_content(file["download_url"], session, headers)
 
-    file_contents = await asyncio.gather(*tasks)
+    tasks = [fetch_bounded(file) for file in file_data if should_fetch_file(file)]
 
-    for file, content in zip(file_data, file_contents):
-        repo_files[file["path"]] = content
+    # Populate results as downloads land instead of holding every response until the end
+    for next_result in asyncio.as_completed(tasks):
+        try:
+            file_path, content = await next_result
+        except Exception as e:
+            logger.warning(f"Failed to fetch file content: {str(e)}")
+            continue
+        if content is not None:
+            repo_files[file_path] = content
 
     return repo_files
 
-async def fetch_file_content(file_url: str, session) -> str:
+def should_fetch_file(file: dict) -> bool:
+    """
+    Decides from the GitHub listing alone whether a file is worth downloading.
+
+    Args:
+        file (dict): File entry from the GitHub API.
+
+    Returns:
+        bool: True for source files within MAX_FILE_SIZE, False for directories,
+            binaries, lock files and other unsupported types.
+    """
+    if file["type"] != "file":
+        return False
+    if os.path.splitext(file["path"])[1].lower() not in ALLOWED_EXTENSIONS:
+        return False
+    return file.get("size", 0) <= MAX_FILE_SIZE
+
+async def fetch_file_content(file_url: str, session, headers: dict = None):
     """
     Fetches the content of an individual file.
 
     Args:
         file_url (str): URL to the file's raw content.
         session (aiohttp.ClientSession): Async session for HTTP requests.
+        headers (dict, optional): Request headers, e.g. the GitHub token needed for private repos.
 
     Returns:
-        str: File content as text.
+        str: File content as text, or None if the download failed.
     """
-    async with session.get(file_url) as response:
+    async with session.get(file_url, headers=headers) as response:
+        await wait_for_rate_limit(response)
         if response.status == 200:
             return await response.text()
-        return f"Error fetching file: {response.status}"
+        logger.warning(f"Error fetching file {file_url}: {response.status}")
+        return None
+
+async def wait_for_rate_limit(response):
+    """
+    Sleeps until the GitHub rate limit resets when few requests remain.
+
+    Args:
+        response (aiohttp.ClientResponse): Response carrying the X-RateLimit-* headers.
+    """
+    remaining = response.headers.get("X-RateLimit-Remaining")
+    reset = response.headers.get("X-RateLimit-Reset")
+    if remaining is None or reset is None or int(remaining) > RATE_LIMIT_THRESHOLD:
+        return
+
+    delay = min(max(int(reset) - time.time(), 0), RATE_LIMIT_MAX_WAIT)
+    logger.warning(f"GitHub rate limit nearly exhausted ({remaining} left), pausing {delay:.0f} seconds.")
+    await asyncio.sleep(delay)
 
 def extract_repo_details(repo_url: str) -> tuple:
     """
@@ -180,6 +381,43 @@ def extract_repo_details(repo_url: str) -> tuple:
         return parts[-2], parts[-1]
     return None, None
 
+def repo_cache_key(repo_url: str) -> str:
+    """
+    Returns the Redis key holding a repository's cached contents.
+
+    Args:
+        repo_url (str): The GitHub repository URL.
+
+    Returns:
+        str: Cache key, versioned by payload format.
+    """
+    return f"{REPO_CACHE_KEY_PREFIX}{repo_url}"
+
+def pack_repo_cache(repo_cache: dict) -> bytes:
+    """
+    Serializes repository data for Redis as zstd-compressed msgpack.
+
+    Args:
+        repo_cache (dict): Repository data to cache.
+
+    Returns:
+        bytes: Compressed payload.
+    """
+    # zstd contexts must not be shared between threads, so each call gets its own
+    return zstandard.ZstdCompressor(level=CACHE_COMPRESSION_LEVEL).compress(msgpack.packb(repo_cache))
+
+def unpack_repo_cache(blob: bytes) -> dict:
+    """
+    Restores repository data produced by pack_repo_cache.
+
+    Args:
+        blob (bytes): Compressed payload read from Redis.
+
+    Returns:
+        dict: Cached repository data.
+    """
+    return msgpack.unpackb(zstandard.ZstdDecompressor().decompress(blob))
+
 def invalidate_cache(repo_url: str):
     """
     Clears the cached repository data.
@@ -187,5 +425,5 @@ def invalidate_cache(repo_url: str):
     Args:
         repo_url (str): The GitHub repository URL.
     """
-    cache_key = f"repo_cache:{repo_url}"
-    redis_client.delete(cache_key)
\ No newline at end of file
+    cache_key = repo_cache_key(repo_url)
+    cache_client.delete(cache_key)
\ No newline at end of file
@@ -1,6 +1,8 @@
 import pytest
+from celery.result import AsyncResult
 from httpx import AsyncClient
-from src.endpoints import app
+from unittest.mock import AsyncMock, MagicMock, patch
+from src.endpoints import RepoRequest, analyze_repo, app
 
 @pytest.mark.asyncio
 async def test_fetch_repo_api():
@@ -8,4 +10,36 @@ async def test_fetch_repo_api():
         response = await client.post("/fetch-repo", json={"repo_url": "https://github.com/django/django"})
     
     assert response.status_code == 200
-    assert "task_id" in response.json()
\ No newline at end of file
+    assert "task_id" in response.json()
+
+@pytest.mark.asyncio
+async def test_analyze_repo_enqueues_fetch_once_while_in_progress():
+    pending_fetch = MagicMock()
+    pending_fetch.ready.return_value = False
+
+    with patch("src.endpoints.fetch_repo_contents_task") as mock_task, \
+            patch("src.endpoints.asyncio.sleep", AsyncMock()):
+        mock_task.apply_async.return_value = pending_fetch
+        response = await analyze_repo(RepoRequest(repo_url="https://github.com/django/django"))
+
+    assert mock_task.apply_async.call_count == 1
+    assert pending_fetch.ready.call_count == 3  # Polled on every attempt
+    assert "still in progress" in response["message"]
+
+@pytest.mark.asyncio
+async def test_analyze_repo_starts_analysis_once_fetch_succeeds():
+    repo_data = {"repo_url": "https://github.com/django/django", "files": {"app.py": "print('hi')"}}
+    finished_fetch = MagicMock(spec=AsyncResult)
+    finished_fetch.ready.return_value = True
+    finished_fetch.failed.return_value = False
+    finished_fetch.result = repo_data
+
+    with patch("src.endpoints.fetch_repo_contents_task") as mock_task, \
+            patch("src.endpoints.analyze_code_task") as mock_analyze, \
+            patch("src.endpoints.asyncio.sleep", AsyncMock()):
+        mock_task.apply_async.return_value = finished_fetch
+        mock_analyze.delay.return_value.id = "analysis-task"
+        response = await analyze_repo(RepoRequest(repo_url=repo_data["repo_url"]))
+
+    mock_analyze.delay.assert_called_once_with(repo_data)
+    assert response == {"task_id": "analysis-task", "message": "AI analysis started"}
@@ -1,11 +1,11 @@
 import pytest
-from unittest.mock import patch
+from unittest.mock import AsyncMock, patch
 from src.repo_manager import fetch_repo_contents_task
 
 def test_fetch_repo_contents_task():
     repo_url = "https://github.com/django/django"
     
-    with patch("src.repo_manager.fetch_repo_contents", return_value={"repo_url": repo_url, "files": {"README.md": "content"}}):
+    with patch("src.repo_manager.fetch_repo_contents", AsyncMock(return_value={"repo_url": repo_url, "files": {"README.md": "content"}})):
         result = fetch_repo_contents_task(repo_url)
 
         assert "repo_url" in result
@@ -1,13 +1,249 @@
+import asyncio
+import hashlib
+import httpx
+import numpy as np
+import openai
+import orjson
 import pytest
-from unittest.mock import AsyncMock, patch
-from src.assistant import store_code_embeddings
+from filelock import FileLock, Timeout
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock, patch
+import src.assistant as assistant
+from src.assistant import analyze_code_task, build_analysis_cache_key, select_files_for_analysis, store_code_embeddings
+
+class FakeAsyncRedis:
+    """In-memory stand-in for the asyncio Redis client used by store_code_embeddings."""
+
+    def __init__(self):
+        self.sets = {}
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    async def sadd(self, key, *members):
+        self.sets.setdefault(key, set()).update(members)
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    def sismember(self, key, member):
+        self.commands.append((key, member))
+        return self
+
+    async def execute(self):
+        return [member in self.redis.sets.get(key, set()) for key, member in self.commands]
+
+@pytest.fixture
+def embedding_store(tmp_path, monkeypatch):
+    """Points the vector index at a temp dir and fakes Redis and the tokenizer."""
+    index_path = str(tmp_path / "repo.faiss")
+    monkeypatch.setattr(assistant, "VECTOR_INDEX_PATH", index_path)
+    monkeypatch.setattr(assistant, "VECTOR_METADATA_PATH", f"{index_path}.meta.json")
+    monkeypatch.setattr(assistant, "VECTOR_LOCK_PATH", f"{index_path}.lock")
+    monkeypatch.setattr(assistant, "vector_index", None)
+    monkeypatch.setattr(assistant, "vector_metadata", [])
+    monkeypatch.setattr(assistant, "vector_index_id", None)
+    monkeypatch.setattr(assistant, "vector_index_stamp", None)
+    monkeypatch.setattr(assistant, "encode_for_embedding", lambda text: list(text.encode()))
+    monkeypatch.setattr(assistant, "EMBEDDING_BATCH_SIZE", 2)
+
+    fake_redis = FakeAsyncRedis()
+    monkeypatch.setattr(assistant, "get_async_meta_client", lambda: fake_redis)
+    return fake_redis
+
+def fake_embeddings_response(inputs):
+    rng = np.random.default_rng(len(inputs))
+    return SimpleNamespace(data=[SimpleNamespace(embedding=rng.random(assistant.EMBEDDING_DIM).tolist()) for _ in inputs])
 
 @pytest.mark.asyncio
-async def test_store_code_embeddings():
-    mock_openai_response = {"data": [{"embedding": [0.1, 0.2, 0.3]}]}
+async def test_store_code_embeddings(embedding_store, monkeypatch):
+    monkeypatch.setattr(assistant, "EMBEDDING_CONCURRENCY", 2)
+    files = {f"f{i}.py": f"print({i})" for i in range(6)}
+    repo_data = {"repo_url": "https://github.com/example/repo", "files": files}
+
+    # f0.py is already in the index's id set and must not be embedded again
+    assistant.load_vector_index()
+    ids_key = assistant.embedding_ids_key()
+    embedding_store.sets[ids_key] = {hashlib.sha256(b"print(0)").hexdigest()}
+
+    in_flight, peak = 0, 0
+
+    async def create(input, model):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0)
+        in_flight -= 1
+        return fake_embeddings_response(input)
+
+    mock_client = MagicMock()
+    mock_client.embeddings.create = AsyncMock(side_effect=create)
 
-    with patch("openai.Embedding.acreate", AsyncMock(return_value=mock_openai_response)):
-        repo_data = {"repo_url": "https://github.com/example/repo", "files": {"test.py": "print('Hello')"}}
+    with patch("src.assistant.get_async_openai_client", return_value=mock_client):
         await store_code_embeddings(repo_data)
 
-        assert True  # If no error occurs, test passes
\ No newline at end of file
+    batch_sizes = [len(call.kwargs["input"]) for call in mock_client.embeddings.create.call_args_list]
+    assert batch_sizes == [2, 2, 1]
+    assert peak == 2  # Bounded by EMBEDDING_CONCURRENCY
+
+    assert assistant.load_vector_index()[0].ntotal == 5
+    assert sorted(row["file_path"] for row in assistant.vector_metadata) == ["f1.py", "f2.py", "f3.py", "f4.py", "f5.py"]
+    assert embedding_store.sets[ids_key] == {hashlib.sha256(code.encode()).hexdigest() for code in files.values()}
+
+    with open(assistant.VECTOR_METADATA_PATH, "rb") as f:
+        assert orjson.loads(f.read())["ntotal"] == 5
+
+@pytest.mark.asyncio
+async def test_store_code_embeddings_keeps_successful_batches(embedding_store):
+    files = {"ok1.py": "a = 1", "ok2.py": "b = 2", "bad.py": "c = 3"}
+    repo_data = {"repo_url": "https://github.com/example/repo", "files": files}
+
+    async def create(input, model):
+        if input == [list(b"c = 3")]:
+            raise RuntimeError("embedding failed")
+        return fake_embeddings_response(input)
+
+    mock_client = MagicMock()
+    mock_client.embeddings.create = AsyncMock(side_effect=create)
+
+    with patch("src.assistant.get_async_openai_client", return_value=mock_client):
+        await store_code_embeddings(repo_data)
+
+    assert sorted(row["file_path"] for row in assistant.vector_metadata) == ["ok1.py", "ok2.py"]
+    assert hashlib.sha256(b"c = 3").hexdigest() not in embedding_store.sets[assistant.embedding_ids_key()]
+
+@pytest.mark.asyncio
+async def test_search_similar_code_does_not_wait_for_writer_lock(embedding_store, monkeypatch):
+    monkeypatch.setattr(assistant, "VECTOR_LOCK_TIMEOUT", 0.1)
+    query_vector = fake_embeddings_response([0]).data[0].embedding
+    row = {"id": "abc", "file_path": "app.py", "repo_url": "https://github.com/example/repo"}
+    await asyncio.to_thread(assistant.add_vectors, [query_vector], [row])
+
+    mock_client = MagicMock()
+    mock_client.embeddings.create = AsyncMock(return_value=SimpleNamespace(data=[SimpleNamespace(embedding=query_vector)]))
+
+    with FileLock(assistant.VECTOR_LOCK_PATH), \
+            patch("src.assistant.get_async_openai_client", return_value=mock_client):
+        results = await assistant.search_similar_code("print hello")
+
+        # Writers still serialize on the lock, but give up after VECTOR_LOCK_TIMEOUT
+        with pytest.raises(Timeout):
+            await asyncio.to_thread(assistant.add_vectors, [query_vector], [row])
+
+    assert [match["file_path"] for match in results] == ["app.py"]
+    assert results[0]["similarity_score"] == pytest.approx(1.0, abs=1e-4)
+
+@pytest.mark.asyncio
+async def test_add_vectors_quantizes_without_blocking_searches(embedding_store, monkeypatch):
+    monkeypatch.setattr(assistant, "QUANTIZE_MIN_VECTORS", 4)
+    vectors = [embedding.embedding for embedding in fake_embeddings_response(range(5)).data]
+    rows = [{"id": str(i), "file_path": f"f{i}.py", "repo_url": "https://github.com/example/repo"} for i in range(5)]
+    await asyncio.to_thread(assistant.add_vectors, vectors[:2], rows[:2])
+
+    quantize_index = assistant.quantize_index
+    guard_held = []
+
+    def tracking_quantize_index(index, new_vectors):
+        guard_held.append(assistant.vector_index_guard.locked())
+        return quantize_index(index, new_vectors)
+
+    monkeypatch.setattr(assistant, "quantize_index", tracking_quantize_index)
+    await asyncio.to_thread(assistant.add_vectors, vectors[2:], rows[2:])
+
+    assert guard_held == [False]  # Searches in this process aren't stalled by the rebuild
+    index, metadata = assistant.load_vector_index()
+    assert isinstance(index, assistant.faiss.IndexHNSWSQ)
+    assert index.ntotal == 5
+    assert [row["file_path"] for row in metadata] == [f"f{i}.py" for i in range(5)]
+
+def test_async_openai_client_is_per_event_loop(monkeypatch):
+    monkeypatch.setattr(assistant, "OPENAI_API_KEY", "test-key")
+
+    async def current_client():
+        client = assistant.get_async_openai_client()
+        return client, assistant.get_async_openai_client() is client
+
+    first, first_reused = asyncio.run(current_client())
+    second, second_reused = asyncio.run(current_client())
+
+    assert first is not second
+    assert first_reused and second_reused
+
+def openai_error(error_type, status_code, headers=None):
+    request = httpx.Request("POST", "https://api.openai.com/v1/embeddings")
+    response = httpx.Response(status_code, headers=headers, request=request)
+    return error_type("request failed", response=response, body=None)
+
+def retry_state_for(error, attempt_number=1):
+    return SimpleNamespace(outcome=SimpleNamespace(exception=lambda: error), attempt_number=attempt_number)
+
+def test_wait_for_retry_after_is_capped():
+    error = openai_error(openai.RateLimitError, 429, {"retry-after": "3600"})
+
+    assert assistant.wait_for_retry_after(retry_state_for(error)) == assistant.EMBEDDING_MAX_RETRY_WAIT
+
+def test_wait_for_retry_after_backs_off_exponentially_for_server_errors():
+    error = openai_error(openai.InternalServerError, 503, {"retry-after": "30"})
+
+    assert assistant.wait_for_retry_after(retry_state_for(error, attempt_number=1)) == 1
+    assert assistant.wait_for_retry_after(retry_state_for(error, attempt_number=3)) == 4
+
+@pytest.mark.asyncio
+async def test_create_embeddings_retries_transient_errors():
+    mock_client = MagicMock()
+    mock_client.embeddings.create = AsyncMock(side_effect=[
+        openai_error(openai.InternalServerError, 500),
+        openai.APIConnectionError(request=httpx.Request("POST", "https://api.openai.com/v1/embeddings")),
+        fake_embeddings_response([[1, 2]]),
+    ])
+
+    with patch("src.assistant.get_async_openai_client", return_value=mock_client), \
+            patch("asyncio.sleep", AsyncMock()):
+        embeddings = await assistant.create_embeddings([[1, 2]])
+
+    assert mock_client.embeddings.create.await_count == 3
+    assert len(embeddings) == 1
+
+def test_build_analysis_cache_key_is_stable():
+    repo_data = {"repo_url": "https://github.com/example/repo", "files": {"b.py": "x = 1", "a.py": "y = 2"}}
+    reordered = {"repo_url": "https://github.com/example/repo", "files": {"a.py": "y = 2", "b.py": "x = 1"}}
+    changed = {"repo_url": "https://github.com/example/repo", "files": {"a.py": "y = 3", "b.py": "x = 1"}}
+
+    assert build_analysis_cache_key(repo_data) == build_analysis_cache_key(reordered)
+    assert build_analysis_cache_key(repo_data) != build_analysis_cache_key(changed)
+    assert build_analysis_cache_key(repo_data).startswith("ai_analysis:")
+
+
+def test_select_files_for_analysis_prefers_complex_files():
+    files = {
+        "flat.py": "x = 1\n",
+        "nested.py": "def f():\n    if x:\n        for y in z:\n            pass\n",
+        "long.py": "y = 2\n" * 50,
+        "README.md": "- item\n    - nested item\n" * 500,
+    }
+
+    selected = select_files_for_analysis(files, limit=2)
+
+    assert [file_path for file_path, _ in selected] == ["nested.py", "long.py"]
+
+
+def test_analyze_code_task_cache_hit_publishes_terminal_event():
+    repo_data = {"repo_url": "https://github.com/example/repo", "files": {"a.py": "y = 2"}}
+
+    with patch("src.assistant.OPENAI_API_KEY", "test-key"), \
+            patch("src.assistant.cache_client") as mock_cache, \
+            patch("src.assistant.meta_client") as mock_meta:
+        mock_cache.pipeline.return_value.execute.return_value = [b"cached analysis", 100]
+        result = analyze_code_task(repo_data)
+
+    messages = [orjson.loads(call.args[1]) for call in mock_meta.publish.call_args_list]
+    assert result == "cached analysis"
+    assert messages == [{"type": "delta", "content": "cached analysis"}, {"type": "done"}]
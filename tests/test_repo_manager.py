@@ -1,19 +1,146 @@
 import pytest
 import asyncio
 import json
-from unittest.mock import AsyncMock, patch
-from src.repo_manager import fetch_repo_contents
+import threading
+import time
+from unittest.mock import AsyncMock, MagicMock, patch
+from src.repo_manager import (
+    RATE_LIMIT_MAX_WAIT,
+    close_async_cache_client,
+    fetch_repo_contents,
+    get_async_cache_client,
+    pack_repo_cache,
+    process_repo_files,
+    should_fetch_file,
+    unpack_repo_cache,
+    wait_for_rate_limit,
+)
 
 @pytest.mark.asyncio
 async def test_fetch_repo_contents_success():
     repo_url = "https://github.com/django/django"
-    mock_response = [{"path": "README.md", "type": "file", "download_url": "https://raw.githubusercontent.com/django/django/main/README.md"}]
+    mock_repo_info = {"default_branch": "main"}
+    mock_tree = {"tree": [{"path": "README.md", "type": "blob", "size": 7, "sha": "abc123"}], "truncated": False}
 
     with patch("aiohttp.ClientSession.get") as mock_get:
         mock_get.return_value.__aenter__.return_value.status = 200
-        mock_get.return_value.__aenter__.return_value.json = AsyncMock(return_value=mock_response)
+        mock_get.return_value.__aenter__.return_value.headers = {}
+        mock_get.return_value.__aenter__.return_value.json = AsyncMock(side_effect=[mock_repo_info, mock_tree])
+        mock_get.return_value.__aenter__.return_value.text = AsyncMock(return_value="content")
 
         result = await fetch_repo_contents(repo_url)
 
         assert "files" in result
-        assert "README.md" in result["files"]
\ No newline at end of file
+        assert "README.md" in result["files"]
+
+def test_should_fetch_file_filters_by_type_and_size():
+    assert should_fetch_file({"path": "src/app.py", "type": "file", "size": 1024})
+    assert not should_fetch_file({"path": "logo.png", "type": "file", "size": 1024})
+    assert not should_fetch_file({"path": "poetry.lock", "type": "file", "size": 1024})
+    assert not should_fetch_file({"path": "src/huge.py", "type": "file", "size": 10_000_000})
+    assert not should_fetch_file({"path": "src", "type": "dir", "size": 0})
+
+
+def test_async_cache_client_is_per_event_loop():
+    async def current_client():
+        return get_async_cache_client()
+
+    async def same_client_within_loop():
+        return get_async_cache_client() is get_async_cache_client()
+
+    # Connections from a closed loop can't be reused, so each asyncio.run gets its own client
+    assert asyncio.run(current_client()) is not asyncio.run(current_client())
+    assert asyncio.run(same_client_within_loop())
+
+
+def test_async_cache_clients_are_not_shared_across_threads():
+    barrier = threading.Barrier(2)
+    clients = {}
+
+    async def use_client(name):
+        client = get_async_cache_client()
+        await asyncio.to_thread(barrier.wait)  # Both threads' loops hold a client at once
+        clients[name] = (client, get_async_cache_client() is client)
+        await close_async_cache_client()
+
+    threads = [threading.Thread(target=asyncio.run, args=(use_client(name),)) for name in ("a", "b")]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert clients["a"][0] is not clients["b"][0]
+    assert clients["a"][1] and clients["b"][1]  # Neither thread's client was replaced by the other's
+
+
+@pytest.mark.asyncio
+async def test_process_repo_files_sends_headers_and_skips_failed_downloads():
+    headers = {"Authorization": "token secret"}
+    file_data = [{"path": "private.py", "type": "file", "size": 10, "download_url": "https://raw.githubusercontent.com/o/r/main/private.py"}]
+    session = MagicMock()
+    session.get.return_value.__aenter__.return_value.status = 404
+    session.get.return_value.__aenter__.return_value.headers = {}
+
+    repo_files = await process_repo_files(file_data, session, headers)
+
+    session.get.assert_called_once_with(file_data[0]["download_url"], headers=headers)
+    assert repo_files == {}
+
+
+@pytest.mark.asyncio
+async def test_wait_for_rate_limit_sleeps_until_reset():
+    nearly_exhausted = MagicMock(headers={"X-RateLimit-Remaining": "1", "X-RateLimit-Reset": str(int(time.time()) + 30)})
+    far_reset = MagicMock(headers={"X-RateLimit-Remaining": "0", "X-RateLimit-Reset": str(int(time.time()) + 3600)})
+    plenty_left = MagicMock(headers={"X-RateLimit-Remaining": "4000", "X-RateLimit-Reset": str(int(time.time()) + 30)})
+
+    with patch("src.repo_manager.asyncio.sleep", AsyncMock()) as mock_sleep:
+        await wait_for_rate_limit(plenty_left)
+        mock_sleep.assert_not_awaited()
+
+        await wait_for_rate_limit(nearly_exhausted)
+        assert 25 <= mock_sleep.await_args.args[0] <= 30
+
+        await wait_for_rate_limit(far_reset)
+        assert mock_sleep.await_args.args[0] == RATE_LIMIT_MAX_WAIT
+
+
+def test_repo_cache_round_trip():
+    repo_cache = {
+        "repo_url": "https://github.com/example/repo",
+        "files": {"src/app.py": "print('héllo')\n" * 200, "README.md": "# Title"},
+        "timestamp": 1700000000.5,
+    }
+
+    blob = pack_repo_cache(repo_cache)
+
+    assert isinstance(blob, bytes)
+    assert len(blob) < len(json.dumps(repo_cache))  # Compressed below the JSON it replaced
+    assert unpack_repo_cache(blob) == repo_cache
+
+
+@pytest.mark.asyncio
+async def test_fetch_repo_contents_refetches_unreadable_cache_entry():
+    repo_url = "https://github.com/example/repo"
+    legacy_entry = json.dumps({"repo_url": repo_url, "files": {}}).encode()  # Pre-msgpack format
+    pipe = MagicMock()
+    pipe.execute = AsyncMock(side_effect=[[legacy_entry, 3600], [True, 1]])
+    client = MagicMock()
+    client.pipeline.return_value.__aenter__.return_value = pipe
+
+    with patch("src.repo_manager.get_async_cache_client", return_value=client), \
+            patch("aiohttp.ClientSession.get") as mock_get:
+        mock_get.return_value.__aenter__.return_value.status = 200
+        mock_get.return_value.__aenter__.return_value.headers = {}
+        mock_get.return_value.__aenter__.return_value.json = AsyncMock(side_effect=[
+            {"default_branch": "main"},
+            {"tree": [{"path": "app.py", "type": "blob", "size": 7}], "truncated": False},
+        ])
+        mock_get.return_value.__aenter__.return_value.text = AsyncMock(return_value="content")
+
+        result = await fetch_repo_contents(repo_url)
+
+    assert result["files"] == {"app.py": "content"}
+    pipe.get.assert_called_once_with(f"repo_cache:v2:{repo_url}")
+    cache_key, _, blob = pipe.setex.call_args.args
+    assert cache_key == f"repo_cache:v2:{repo_url}"
+    assert unpack_repo_cache(blob)["files"] == {"app.py": "content"}
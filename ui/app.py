@@ -7,9 +7,22 @@ and receive AI-generated insights.
 
 import streamlit as st
 import requests
+from requests.adapters import HTTPAdapter
 
 # FastAPI backend URL
 API_URL = "http://localhost:8000/analyze"
+REQUEST_TIMEOUT = 30  # seconds
+
+@st.cache_resource
+def get_session() -> requests.Session:
+    """
+    Returns an HTTP session shared across Streamlit reruns so backend connections are kept alive.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=4)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
 
 st.title("Repository Analysis v2")
 
@@ -19,7 +32,7 @@ repo_url = st.text_input("Enter GitHub Repository URL", "")
 if st.button("Analyze Repo"):
     if repo_url:
         with st.spinner("Analyzing..."):
-            response = requests.post(API_URL, json={"repo_url": repo_url})
+            response = get_session().post(API_URL, json={"repo_url": repo_url}, timeout=REQUEST_TIMEOUT)
             if response.status_code == 200:
                 analysis = response.json()
                 st.subheader("Analysis Results")